@@ -0,0 +1,237 @@
+"""
+Receipt Automation Metrics (Prometheus textfile format)
+
+Collects counters, gauges and latency histograms while the Smokeball receipt
+automation runs, and flushes them to a file that the node_exporter textfile
+collector can scrape.
+
+Counters and histograms are cumulative across runs: each flush merges this
+process's increments into whatever is already in the file, under an exclusive
+lock, so concurrent automation processes never lose each other's updates.
+Gauges are last-writer-wins. The file is replaced atomically so the collector
+never reads a half-written file.
+
+Usage:
+    metrics = ReceiptMetrics('/var/lib/node_exporter/textfile/smokeball_receipt.prom')
+    metrics.inc('runs_total', outcome='success', mode='submit')
+    with metrics.time('phase_duration_seconds', phase='login'):
+        ...
+    metrics.flush()
+
+If no path is given (and SMOKEBALL_METRICS_FILE is unset), metrics are still
+collected in memory but flush() is a no-op.
+"""
+
+import os
+import re
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+NAMESPACE = 'smokeball_receipt'
+
+# Latency buckets in seconds - fixed so series stay comparable across runs
+DEFAULT_BUCKETS = (0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+# name -> (type, help)
+METRICS = {
+    'runs_total': ('counter', 'Automation runs by outcome and mode'),
+    'login_total': ('counter', 'Login attempts by outcome'),
+    'two_factor_attempts_total': ('counter', '2FA code submissions by method and outcome'),
+    'deposit_strategy_total': ('counter', 'Which strategy found the Deposit Funds button'),
+    'navigation_total': ('counter', 'Matter navigations by mode (spa, spa_fallback, full)'),
+    'field_fill_total': ('counter', 'Form field fills by field and method (primary, fallback, failed)'),
+    'phase_duration_seconds': ('histogram', 'Duration of each automation phase'),
+    'last_run_timestamp_seconds': ('gauge', 'Unix time the last run finished'),
+    'last_success_timestamp_seconds': ('gauge', 'Unix time the last successful run finished'),
+    'last_run_duration_seconds': ('gauge', 'End-to-end duration of the last run'),
+    'queue_depth': ('gauge', 'Pending scheduler jobs by priority'),
+    'queue_oldest_wait_seconds': ('gauge', 'Age of the oldest pending job by priority'),
+    'queue_wait_seconds': ('histogram', 'Time jobs spent queued before starting'),
+    'job_deadline_total': ('counter', 'Jobs with a deadline by result (met, missed)'),
+}
+
+_SAMPLE_RE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})?\s+(\S+)\s*$')
+_LABEL_RE = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}'
+
+
+class ReceiptMetrics:
+    def __init__(self, path=None, buckets=DEFAULT_BUCKETS):
+        self.path = path or os.getenv('SMOKEBALL_METRICS_FILE')
+        self.buckets = tuple(sorted(buckets))
+        # (sample_name, labels) -> increment since last flush
+        self._deltas = {}
+        # (sample_name, labels) -> absolute value
+        self._gauges = {}
+
+    def _key(self, sample_name, labels):
+        return (sample_name, tuple(sorted((k, _escape(v)) for k, v in labels.items())))
+
+    def _full_name(self, name):
+        if name not in METRICS:
+            raise KeyError(f'Unknown metric: {name}')
+        return f'{NAMESPACE}_{name}'
+
+    def inc(self, name, value=1, **labels):
+        """Increment a counter"""
+        key = self._key(self._full_name(name), labels)
+        self._deltas[key] = self._deltas.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        """Set a gauge"""
+        self._gauges[self._key(self._full_name(name), labels)] = value
+
+    def observe(self, name, value, **labels):
+        """Record a histogram observation"""
+        full_name = self._full_name(name)
+        # Every bucket gets a sample (0 if above it) so each series always has the full le set
+        for le in self.buckets + (float('inf'),):
+            key = self._key(f'{full_name}_bucket', dict(labels, le=_format_value(le)))
+            self._deltas[key] = self._deltas.get(key, 0) + (1 if value <= le else 0)
+        for suffix, delta in (('_sum', value), ('_count', 1)):
+            key = self._key(f'{full_name}{suffix}', labels)
+            self._deltas[key] = self._deltas.get(key, 0) + delta
+
+    @contextmanager
+    def time(self, name, **labels):
+        """Observe the duration of a block (recorded even if it raises)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def flush(self):
+        """Merge pending updates into the textfile and replace it atomically"""
+        if not self.path or not (self._deltas or self._gauges):
+            return False
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+
+        with open(f'{self.path}.lock', 'a+') as lock_file:
+            self._lock(lock_file)
+            try:
+                samples, families = self._read_existing()
+                for key, delta in self._deltas.items():
+                    samples[key] = samples.get(key, 0) + delta
+                samples.update(self._gauges)
+                for name, (metric_type, help_text) in METRICS.items():
+                    families[f'{NAMESPACE}_{name}'] = (metric_type, help_text)
+                self._write(samples, families, directory)
+            finally:
+                self._unlock(lock_file)
+
+        self._deltas.clear()
+        self._gauges.clear()
+        return True
+
+    def _lock(self, lock_file):
+        if fcntl:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+
+    def _unlock(self, lock_file):
+        if fcntl:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def _read_existing(self):
+        """Parse a textfile previously written by flush()"""
+        samples = {}
+        families = {}
+        helps = {}
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                lines = f.read().splitlines()
+        except FileNotFoundError:
+            return samples, families
+
+        for line in lines:
+            if line.startswith('# HELP '):
+                parts = line.split(' ', 3)
+                if len(parts) == 4:
+                    helps[parts[2]] = parts[3]
+            elif line.startswith('# TYPE '):
+                parts = line.split(' ')
+                if len(parts) == 4:
+                    families[parts[2]] = (parts[3], helps.get(parts[2], ''))
+            elif line and not line.startswith('#'):
+                match = _SAMPLE_RE.match(line)
+                if not match:
+                    continue
+                name, raw_labels, raw_value = match.groups()
+                labels = tuple(sorted(_LABEL_RE.findall(raw_labels or '')))
+                try:
+                    samples[(name, labels)] = float(raw_value)
+                except ValueError:
+                    continue
+        return samples, families
+
+    def _write(self, samples, families, directory):
+        import tempfile
+
+        by_family = {}
+        for (name, labels), value in samples.items():
+            family = name
+            for suffix in ('_bucket', '_sum', '_count'):
+                if name.endswith(suffix) and families.get(name[:-len(suffix)], ('',))[0] == 'histogram':
+                    family = name[:-len(suffix)]
+            by_family.setdefault(family, []).append((name, labels, value))
+
+        def sort_key(sample):
+            name, labels, _ = sample
+            le = dict(labels).get('le')
+            le_value = float('inf') if le == '+Inf' else float(le) if le else 0
+            without_le = tuple(l for l in labels if l[0] != 'le')
+            return (name, without_le, le_value)
+
+        lines = []
+        for family in sorted(by_family):
+            metric_type, help_text = families.get(family, ('untyped', ''))
+            if help_text:
+                lines.append(f'# HELP {family} {help_text}')
+            lines.append(f'# TYPE {family} {metric_type}')
+            for name, labels, value in sorted(by_family[family], key=sort_key):
+                lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.receipt-metrics-', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write('\n'.join(lines) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, self.path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
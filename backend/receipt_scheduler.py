@@ -0,0 +1,420 @@
+"""
+Smokeball Receipt Job Scheduler
+
+Puts a persistent, priority and deadline-aware queue in front of the receipt
+automation so time-critical receipts are not stuck behind bulk backfills.
+
+- Priority classes: urgent (settlement day), normal (manual / Stripe webhook), bulk (month-end runs)
+- Deadlines: a job whose deadline is within --urgent-window seconds is treated as urgent;
+  within a class, earliest deadline runs first
+- Coalescing: enqueuing a receipt identical to a pending or running job returns the
+  existing job (keeping the higher priority and earlier deadline) instead of adding a duplicate
+- Rate limit: at most one job starts every --min-interval seconds across all workers
+- Jobs are stored in SQLite, so the queue survives restarts and can be shared by processes
+- Session reuse: a worker keeps one logged-in browser across consecutive jobs and moves
+  between matters with in-app navigation; the session closes when the queue runs empty
+- Recovery: jobs whose worker process has died are released before every claim and enqueue,
+  so duplicates never coalesce into a dead job. --stale-after only applies to workers whose
+  liveness can't be checked (another host, or Windows)
+- enqueue prints only {"job_id": ...} on stdout; progress messages go to stderr
+
+Usage:
+    python receipt_scheduler.py enqueue --matter-id MATTER_ID --amount 81.70 --lastname Stanford --firstname Logan --priority urgent --within 30
+    python receipt_scheduler.py work [--once]
+    python receipt_scheduler.py stats
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+from receipt_metrics import ReceiptMetrics
+
+PRIORITIES = {'urgent': 0, 'normal': 1, 'bulk': 2}
+DEFAULT_DB_PATH = os.getenv('SMOKEBALL_RECEIPT_QUEUE', 'receipt-queue.sqlite3')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    dedupe_key TEXT NOT NULL,
+    matter_id TEXT NOT NULL,
+    receipt_data TEXT NOT NULL,
+    test_mode INTEGER NOT NULL,
+    priority INTEGER NOT NULL,
+    source TEXT,
+    deadline REAL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    enqueued_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    coalesced INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, priority, deadline, enqueued_at);
+CREATE TABLE IF NOT EXISTS scheduler_state (
+    key TEXT PRIMARY KEY,
+    value REAL
+);
+"""
+
+
+class ReceiptScheduler:
+    def __init__(self, db_path=DEFAULT_DB_PATH, min_interval=30, urgent_window=900, stale_after=600, metrics=None):
+        self.db_path = db_path
+        self.min_interval = min_interval
+        self.urgent_window = urgent_window
+        self.stale_after = stale_after
+        self.metrics = metrics or ReceiptMetrics()
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}'
+        self.conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(SCHEMA)
+        # Queue files created before the worker column existed
+        columns = {row['name'] for row in self.conn.execute('PRAGMA table_info(jobs)')}
+        if 'worker' not in columns:
+            self.conn.execute('ALTER TABLE jobs ADD COLUMN worker TEXT')
+
+    @staticmethod
+    def dedupe_key(matter_id, receipt_data, test_mode):
+        """Jobs for the same matter, amount, date and contact are the same receipt"""
+        fields = [matter_id, receipt_data.get('amount'), receipt_data.get('date'),
+                  receipt_data.get('lastname'), receipt_data.get('firstname'), bool(test_mode)]
+        return hashlib.sha256(json.dumps(fields).encode('utf-8')).hexdigest()
+
+    def enqueue(self, matter_id, receipt_data, priority='normal', deadline=None, source=None, test_mode=True):
+        """Add a job, or coalesce it into an identical pending/running job. Returns the job ID."""
+        if priority not in PRIORITIES:
+            raise ValueError(f'Unknown priority: {priority} (expected one of {", ".join(PRIORITIES)})')
+        key = self.dedupe_key(matter_id, receipt_data, test_mode)
+
+        # Release jobs held by dead workers first so we never coalesce into one
+        self.recover()
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            existing = self.conn.execute(
+                "SELECT * FROM jobs WHERE dedupe_key = ? AND status IN ('pending', 'running')",
+                (key,)
+            ).fetchone()
+            if existing:
+                deadlines = [d for d in (existing['deadline'], deadline) if d is not None]
+                self.conn.execute(
+                    'UPDATE jobs SET priority = ?, deadline = ?, coalesced = coalesced + 1 WHERE id = ?',
+                    (min(existing['priority'], PRIORITIES[priority]), min(deadlines) if deadlines else None, existing['id'])
+                )
+                job_id = existing['id']
+                print(f'🔗 Coalesced into existing job #{job_id} ({existing["status"]})', file=sys.stderr)
+            else:
+                cursor = self.conn.execute(
+                    'INSERT INTO jobs (dedupe_key, matter_id, receipt_data, test_mode, priority, source, deadline, enqueued_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (key, matter_id, json.dumps(receipt_data), int(bool(test_mode)), PRIORITIES[priority],
+                     source, deadline, time.time())
+                )
+                job_id = cursor.lastrowid
+                print(f'📥 Enqueued job #{job_id} ({priority})', file=sys.stderr)
+            self.conn.execute('COMMIT')
+        except Exception:
+            self.conn.execute('ROLLBACK')
+            raise
+        return job_id
+
+    def claim_next(self):
+        """
+        Atomically claim the most urgent pending job.
+
+        Returns (job, wait_seconds): job is None if the queue is empty, wait_seconds > 0
+        if the rate limit does not allow a new job yet.
+        """
+        now = time.time()
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = self.conn.execute("SELECT value FROM scheduler_state WHERE key = 'last_started_at'").fetchone()
+            last_started = row['value'] if row else 0
+            wait = last_started + self.min_interval - now
+
+            job = self.conn.execute(
+                """
+                SELECT * FROM jobs WHERE status = 'pending'
+                ORDER BY
+                    CASE WHEN deadline IS NOT NULL AND deadline - ? <= ? THEN 0 ELSE priority END,
+                    deadline IS NULL, deadline, enqueued_at
+                LIMIT 1
+                """,
+                (now, self.urgent_window)
+            ).fetchone()
+
+            if not job:
+                self.conn.execute('COMMIT')
+                return None, 0
+            if wait > 0:
+                self.conn.execute('COMMIT')
+                return None, wait
+
+            self.conn.execute(
+                "UPDATE jobs SET status = 'running', started_at = ?, worker = ? WHERE id = ?",
+                (now, self.worker_id, job['id'])
+            )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO scheduler_state (key, value) VALUES ('last_started_at', ?)", (now,)
+            )
+            self.conn.execute('COMMIT')
+        except Exception:
+            self.conn.execute('ROLLBACK')
+            raise
+
+        self.metrics.observe('queue_wait_seconds', now - job['enqueued_at'],
+                             priority=_priority_name(job['priority']))
+        return job, 0
+
+    def finish(self, job, result):
+        """
+        Record the outcome of a claimed job.
+
+        Returns False (and leaves the job alone) if it is no longer running under this
+        worker, e.g. because recover() released it in the meantime.
+        """
+        now = time.time()
+        status = 'succeeded' if result.get('success') else 'failed'
+        cursor = self.conn.execute(
+            "UPDATE jobs SET status = ?, finished_at = ?, error = ? "
+            "WHERE id = ? AND status = 'running' AND worker = ?",
+            (status, now, result.get('error'), job['id'], self.worker_id)
+        )
+        if not cursor.rowcount:
+            print(f'⚠️ Job #{job["id"]} was released by recovery - not recording result ({status})',
+                  file=sys.stderr)
+            return False
+        if job['deadline'] is not None:
+            met = 'met' if now <= job['deadline'] else 'missed'
+            self.metrics.inc('job_deadline_total', result=met, priority=_priority_name(job['priority']))
+        return True
+
+    def recover(self):
+        """
+        Handle jobs left 'running' by a worker that died.
+
+        A job is considered abandoned if its worker process on this host no longer exists.
+        If the worker's liveness can't be checked (another host, or Windows), it is
+        abandoned once it has been running for longer than stale_after seconds instead,
+        so a slow run of a live local worker is never released. Test-mode jobs are
+        requeued. Submit jobs are marked failed instead, since the receipt may already have
+        been created and re-running could duplicate it.
+        """
+        now = time.time()
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            running = self.conn.execute(
+                "SELECT id, test_mode, started_at, worker FROM jobs WHERE status = 'running'"
+            ).fetchall()
+            abandoned = []
+            for job in running:
+                alive = _worker_alive(job['worker'])
+                if alive is None:
+                    alive = (job['started_at'] or 0) >= now - self.stale_after
+                if not alive:
+                    abandoned.append(job)
+            requeued = failed = 0
+            for job in abandoned:
+                if job['test_mode']:
+                    self.conn.execute(
+                        "UPDATE jobs SET status = 'pending', started_at = NULL, worker = NULL WHERE id = ?",
+                        (job['id'],)
+                    )
+                    requeued += 1
+                else:
+                    self.conn.execute(
+                        "UPDATE jobs SET status = 'failed', finished_at = ?, "
+                        "error = 'Worker interrupted - check Smokeball before re-queueing' WHERE id = ?",
+                        (now, job['id'])
+                    )
+                    failed += 1
+            self.conn.execute('COMMIT')
+        except Exception:
+            self.conn.execute('ROLLBACK')
+            raise
+        if requeued:
+            print(f'♻️ Requeued {requeued} interrupted test-mode job(s)', file=sys.stderr)
+        if failed:
+            print(f'⚠️ Marked {failed} interrupted submit job(s) as failed', file=sys.stderr)
+
+    def stats(self):
+        """Queue depth per priority and the age of the oldest pending job"""
+        now = time.time()
+        rows = self.conn.execute(
+            "SELECT priority, COUNT(*) AS depth, MIN(enqueued_at) AS oldest FROM jobs "
+            "WHERE status = 'pending' GROUP BY priority"
+        ).fetchall()
+        depth = {name: 0 for name in PRIORITIES}
+        oldest_wait = {name: 0 for name in PRIORITIES}
+        for row in rows:
+            name = _priority_name(row['priority'])
+            depth[name] = row['depth']
+            oldest_wait[name] = round(now - row['oldest'], 3)
+        running = self.conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'running'").fetchone()[0]
+
+        for name in PRIORITIES:
+            self.metrics.set('queue_depth', depth[name], priority=name)
+            self.metrics.set('queue_oldest_wait_seconds', oldest_wait[name], priority=name)
+        return {'depth': depth, 'oldest_wait_seconds': oldest_wait, 'running': running}
+
+    async def work(self, once=False, poll_interval=5):
+        """
+        Run queued jobs one at a time, honouring the rate limit.
+
+        Consecutive jobs share one logged-in browser session, so each job after the first
+        only navigates to its matter inside the app. The session is closed whenever the
+        queue runs empty.
+        """
+        from smokeball_receipt_automation import SmokeBallReceiptAutomation
+
+        # No one is watching a scheduled run, so skip the test-mode inspection pause
+        automation = SmokeBallReceiptAutomation(metrics=self.metrics, inspection_seconds=0)
+        try:
+            while True:
+                self.recover()
+                job, wait = self.claim_next()
+                self.stats()
+                self._flush_metrics()
+
+                if not job:
+                    if automation.session_active and not wait:
+                        await automation.end_session()
+                    if once and not wait:
+                        print('📭 Queue empty')
+                        return
+                    await asyncio.sleep(wait or poll_interval)
+                    continue
+
+                receipt_data = json.loads(job['receipt_data'])
+                print(f'\n▶️ Job #{job["id"]} ({_priority_name(job["priority"])}, source: {job["source"] or "n/a"})')
+                automation.test_mode = bool(job['test_mode'])
+                try:
+                    result = await automation.process(job['matter_id'], receipt_data)
+                except Exception as e:
+                    result = {'success': False, 'error': str(e)}
+                self.finish(job, result)
+                self._flush_metrics()
+                print(f'{"✅" if result["success"] else "❌"} Job #{job["id"]} {"succeeded" if result["success"] else "failed"}')
+
+                if once:
+                    return
+        finally:
+            await automation.end_session()
+
+    def _flush_metrics(self):
+        try:
+            self.metrics.flush()
+        except Exception as e:
+            print(f'⚠️ Failed to write metrics: {e}', file=sys.stderr)
+
+
+def _worker_alive(worker):
+    """True/False for a worker process on this host, None if that can't be checked"""
+    if not worker or os.name == 'nt':
+        return None  # Only the stale_after timeout applies
+    host, _, pid = worker.rpartition(':')
+    if host != socket.gethostname() or not pid.isdigit():
+        return None
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _priority_name(value):
+    return next(name for name, number in PRIORITIES.items() if number == value)
+
+
+def _parse_deadline(args):
+    if args.within is not None:
+        return time.time() + args.within * 60
+    if args.deadline:
+        return datetime.fromisoformat(args.deadline).timestamp()
+    return None
+
+
+def main():
+    """Main entry point"""
+    parser = argparse.ArgumentParser(description='Smokeball Receipt Job Scheduler')
+    parser.add_argument('--db', default=DEFAULT_DB_PATH,
+                       help=f'SQLite queue file (default: {DEFAULT_DB_PATH}, or $SMOKEBALL_RECEIPT_QUEUE)')
+    parser.add_argument('--min-interval', type=float, default=30,
+                       help='Minimum seconds between job starts toward Smokeball (default: 30)')
+    parser.add_argument('--urgent-window', type=float, default=900,
+                       help='Treat jobs due within this many seconds as urgent (default: 900)')
+    parser.add_argument('--stale-after', type=float, default=600,
+                       help='Treat running jobs older than this many seconds as abandoned when their worker '
+                            'cannot be checked, e.g. on another host (default: 600)')
+    parser.add_argument('--metrics-file', default=os.getenv('SMOKEBALL_METRICS_FILE'),
+                       help='Prometheus textfile for queue metrics (default: $SMOKEBALL_METRICS_FILE)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    enqueue = subparsers.add_parser('enqueue', help='Add a receipt job')
+    enqueue.add_argument('--matter-id', required=True, help='Matter ID')
+    enqueue.add_argument('--amount', type=float, required=True, help='Amount')
+    enqueue.add_argument('--lastname', required=True, help='Contact lastname')
+    enqueue.add_argument('--firstname', required=True, help='Contact firstname')
+    enqueue.add_argument('--reason', default='On account of search fees', help='Reason for receipt')
+    enqueue.add_argument('--date', default=datetime.now().strftime('%d/%m/%Y'),
+                        help='Date deposited (default: today)')
+    enqueue.add_argument('--priority', choices=list(PRIORITIES), default='normal',
+                        help='Priority class (default: normal)')
+    enqueue.add_argument('--deadline', help='Deadline as ISO 8601 datetime, e.g. 2025-11-21T15:00')
+    enqueue.add_argument('--within', type=float, help='Deadline in minutes from now')
+    enqueue.add_argument('--source', help='Where the job came from (manual, stripe, bulk)')
+    enqueue.add_argument('--submit', action='store_true', help='Actually submit the receipt')
+
+    work = subparsers.add_parser('work', help='Process queued jobs')
+    work.add_argument('--once', action='store_true', help='Run at most one job, then exit')
+
+    subparsers.add_parser('stats', help='Print queue depth and wait times as JSON')
+
+    args = parser.parse_args()
+
+    scheduler = ReceiptScheduler(
+        args.db,
+        min_interval=args.min_interval,
+        urgent_window=args.urgent_window,
+        stale_after=args.stale_after,
+        metrics=ReceiptMetrics(args.metrics_file)
+    )
+
+    if args.command == 'enqueue':
+        receipt_data = {
+            'amount': args.amount,
+            'date': args.date,
+            'lastname': args.lastname,
+            'firstname': args.firstname,
+            'reason': args.reason,
+            'description': 'Bank Transfer deposit',
+            'type': 'Deposit'
+        }
+        job_id = scheduler.enqueue(args.matter_id, receipt_data, priority=args.priority,
+                                   deadline=_parse_deadline(args), source=args.source,
+                                   test_mode=not args.submit)
+        print(json.dumps({'job_id': job_id}))
+    elif args.command == 'work':
+        asyncio.run(scheduler.work(once=args.once))
+    elif args.command == 'stats':
+        print(json.dumps(scheduler.stats(), indent=2))
+        scheduler._flush_metrics()
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except KeyboardInterrupt:
+        print('\n⚠️ Interrupted by user')
+        sys.exit(1)
@@ -0,0 +1,121 @@
+"""
+Failure-only Rolling Trace Buffer
+
+Keeps Playwright tracing (DOM snapshots, screenshots, network, console) running
+in one chunk per automation step, retaining only the last few steps. Nothing is
+kept for successful runs; when a run fails, the retained chunks are written to
+a timestamped folder under traces/ that can be opened with:
+
+    playwright show-trace traces/<timestamp>-<pid>/<NN>-<step>.zip
+
+Only the newest `max_traces` failure folders are kept.
+"""
+
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+
+class RollingTrace:
+    def __init__(self, traces_dir='traces', keep_steps=3, keep_seconds=None, max_traces=20):
+        self.traces_dir = Path(traces_dir)
+        self.keep_steps = max(1, keep_steps)
+        self.keep_seconds = keep_seconds
+        self.max_traces = max_traces
+        self.context = None
+        self._spool_dir = None
+        self._retained = []  # [(path, step, started)] for closed chunks, oldest first
+        self._current = None  # (step, started) for the open chunk
+        self._seq = 0
+
+    async def start(self, context):
+        """Start tracing on a browser context"""
+        self.context = context
+        self._spool_dir = Path(tempfile.mkdtemp(prefix='receipt-trace-'))
+        await context.tracing.start(screenshots=True, snapshots=True, sources=False)
+
+    async def step(self, name):
+        """Begin a new chunk, rolling older chunks out of the buffer"""
+        if not self.context:
+            return
+        await self._close_chunk()
+        self._seq += 1
+        self._current = (name, time.time())
+        await self.context.tracing.start_chunk(title=name)
+
+    async def _close_chunk(self):
+        if not self._current:
+            return
+        step, started = self._current
+        self._current = None
+        if self.keep_steps == 1:
+            # Only the open chunk is ever needed - discard without writing
+            await self.context.tracing.stop_chunk()
+            return
+
+        path = self._spool_dir / f'{self._seq:02d}-{step}.zip'
+        await self.context.tracing.stop_chunk(path=str(path))
+        self._retained.append((path, step, started))
+        self._prune_retained()
+
+    def _prune_retained(self):
+        cutoff = time.time() - self.keep_seconds if self.keep_seconds else None
+        # The open chunk counts towards keep_steps
+        while self._retained and (
+            len(self._retained) > self.keep_steps - 1
+            or (cutoff and self._retained[0][2] < cutoff)
+        ):
+            path, _, _ = self._retained.pop(0)
+            path.unlink(missing_ok=True)
+
+    async def save_failure(self, reason=''):
+        """Write the buffered chunks to disk and stop tracing"""
+        if not self.context:
+            return None
+        timestamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        target = self.traces_dir / f'{timestamp}-{os.getpid()}'
+        target.mkdir(parents=True, exist_ok=True)
+
+        if self._current:
+            step, _ = self._current
+            self._current = None
+            await self.context.tracing.stop_chunk(path=str(target / f'{self._seq:02d}-{step}.zip'))
+        for path, _, _ in self._retained:
+            shutil.move(str(path), str(target / path.name))
+        self._retained = []
+        if reason:
+            (target / 'error.txt').write_text(str(reason), encoding='utf-8')
+
+        await self._stop()
+        self._prune_traces()
+        print(f'🧵 Trace saved: {target}')
+        return str(target)
+
+    async def discard(self):
+        """Drop the buffer and stop tracing (successful run)"""
+        if not self.context:
+            return
+        if self._current:
+            self._current = None
+            await self.context.tracing.stop_chunk()
+        self._retained = []
+        await self._stop()
+
+    async def _stop(self):
+        try:
+            await self.context.tracing.stop()
+        finally:
+            self.context = None
+            if self._spool_dir:
+                shutil.rmtree(self._spool_dir, ignore_errors=True)
+                self._spool_dir = None
+
+    def _prune_traces(self):
+        if not self.max_traces:
+            return
+        runs = sorted((p for p in self.traces_dir.iterdir() if p.is_dir()), key=lambda p: p.name)
+        for old in runs[:-self.max_traces]:
+            shutil.rmtree(old, ignore_errors=True)
@@ -16,35 +16,94 @@ Usage:
 
 Example:
     python smokeball_receipt_automation.py --matter-id ce2582fe-b415-4f95-b9b9-c79c903a4654 --amount 81.70 --lastname Stanford --firstname Logan --test-mode
+
+Validate configuration only (no browser, no Playwright import):
+    python smokeball_receipt_automation.py --check
+
+Machine-readable progress (NDJSON events on stdout, logs on stderr):
+    python smokeball_receipt_automation.py --events --submit
 """
 
-import asyncio
+import json
 import os
 import sys
-from datetime import datetime
+import time
+from datetime import datetime, timezone
 from pathlib import Path
-from dotenv import load_dotenv
 
-try:
-    from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError
-except ImportError:
-    print("❌ Playwright not installed. Install with: pip install playwright")
-    print("   Then run: playwright install chromium")
-    sys.exit(1)
+from receipt_metrics import ReceiptMetrics
+
+# Playwright, pyotp, python-dotenv and asyncio are imported on first use so that importing
+# this module, --help and --check stay fast and free of side effects.
+_env_loaded = False
+_pyotp = None
+
 
-try:
-    import pyotp
-except ImportError:
-    print("⚠️ pyotp not installed. 2FA will require manual input.")
-    print("   Install with: pip install pyotp")
-    pyotp = None
+def load_env():
+    """Load .env into the environment (once)"""
+    global _env_loaded
+    if _env_loaded:
+        return
+    _env_loaded = True
+    try:
+        from dotenv import load_dotenv
+    except ImportError:
+        # stderr: this can run before --events moves prints off stdout
+        print("⚠️ python-dotenv not installed - using existing environment variables only", file=sys.stderr)
+        return
+    load_dotenv()
+
+
+def load_pyotp():
+    """Import pyotp, or return None if it is not installed"""
+    global _pyotp
+    if _pyotp is None:
+        try:
+            import pyotp
+            _pyotp = pyotp
+        except ImportError:
+            print("⚠️ pyotp not installed. 2FA will require manual input.")
+            print("   Install with: pip install pyotp")
+            _pyotp = False
+    return _pyotp or None
+
+
+class EventStream:
+    """
+    Writes one JSON object per line (NDJSON) for each phase transition, e.g.
+
+        {"event": "authenticated", "ts": "2025-11-21T01:02:03.456+00:00", "elapsed_ms": 8123}
+
+    Terminal events are "completed" and "failed"; both include the run result.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.started = time.perf_counter()
+
+    def emit(self, event, **data):
+        record = {
+            'event': event,
+            'ts': datetime.now(timezone.utc).isoformat(timespec='milliseconds'),
+            'elapsed_ms': round((time.perf_counter() - self.started) * 1000),
+            **data
+        }
+        self.stream.write(json.dumps(record) + '\n')
+        self.stream.flush()
 
-load_dotenv()
+
+SMOKEBALL_APP_URL = 'https://app.smokeball.com.au'
+TRANSACTIONS_GRID_SELECTOR = 'table, [role="grid"]'
+# Data rows only - header rows use th / columnheader
+TRANSACTIONS_ROW_SELECTOR = 'tbody tr, [role="gridcell"]'
 
 
 class SmokeBallReceiptAutomation:
-    def __init__(self, test_mode=True):
+    def __init__(self, test_mode=True, metrics=None, trace=None, spa_navigation=True, events=None,
+                 inspection_seconds=30):
+        load_env()
         self.browser = None
+        self.context = None
         self.page = None
         self.test_mode = test_mode
         self.credentials = {
@@ -52,12 +111,24 @@ class SmokeBallReceiptAutomation:
             'password': os.getenv('SMOKEBALL_PASSWORD', 'LegalxManocha25!'),
             'two_factor_secret': os.getenv('SMOKEBALL_2FA_SECRET')
         }
-        self.screenshots_dir = Path('screenshots')
-        self.screenshots_dir.mkdir(exist_ok=True)
+        self.screenshots_dir = Path('screenshots')  # Created on first screenshot
+        self.metrics = metrics or ReceiptMetrics()
+        # When set, a rolling Playwright trace replaces the per-step screenshots
+        self.trace = trace
+        self.spa_navigation = spa_navigation
+        # Optional EventStream for machine-readable progress (--events)
+        self.events = events
+        # How long to keep the browser open after a test-mode run (0 to skip)
+        self.inspection_seconds = inspection_seconds
+        # Set once logged in; process() reuses the page until end_session()
+        self.session_active = False
+        # True while a receipt dialog is open (left open by test-mode runs)
+        self.dialog_open = False
 
     def generate_totp_code(self):
         """Generate TOTP code for 2FA"""
-        if not self.credentials['two_factor_secret'] or not pyotp:
+        pyotp = load_pyotp() if self.credentials['two_factor_secret'] else None
+        if not pyotp:
             raise ValueError('2FA secret not configured or pyotp not installed')
         
         totp = pyotp.TOTP(self.credentials['two_factor_secret'])
@@ -68,6 +139,11 @@ class SmokeBallReceiptAutomation:
     async def initialize(self):
         """Initialize browser and page"""
         print('🚀 Initializing browser...')
+        try:
+            from playwright.async_api import async_playwright
+        except ImportError:
+            raise Exception('Playwright not installed. Install with: pip install playwright, then run: playwright install chromium')
+        
         playwright = await async_playwright().start()
         
         self.browser = await playwright.chromium.launch(
@@ -80,7 +156,8 @@ class SmokeBallReceiptAutomation:
             ]
         )
         
-        self.page = await self.browser.new_page()
+        self.context = await self.browser.new_context()
+        self.page = await self.context.new_page()
         self.page.set_default_timeout(30000)
         self.page.set_default_navigation_timeout(45000)
         
@@ -90,12 +167,23 @@ class SmokeBallReceiptAutomation:
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
         })
         
+        if self.trace:
+            try:
+                await self.trace.start(self.context)
+                print('🧵 Rolling trace buffer started (saved on failure only)')
+            except Exception as e:
+                print(f'⚠️ Failed to start trace, falling back to screenshots: {e}')
+                self.trace = None
+        
         print('✅ Browser initialized')
 
     async def take_screenshot(self, name='debug'):
         """Take a debug screenshot"""
+        if self.trace:
+            return None  # Covered by the trace's DOM snapshots
         try:
             timestamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+            self.screenshots_dir.mkdir(exist_ok=True)
             filename = self.screenshots_dir / f'receipt-{name}-{timestamp}.png'
             await self.page.screenshot(path=str(filename), full_page=True)
             print(f'📸 Screenshot saved: {filename}')
@@ -106,10 +194,12 @@ class SmokeBallReceiptAutomation:
 
     async def login(self):
         """Login to Smokeball"""
+        import asyncio
+        
         print('🔐 Logging into Smokeball...')
         
         try:
-            await self.page.goto('https://app.smokeball.com.au', wait_until='networkidle')
+            await self.page.goto(SMOKEBALL_APP_URL, wait_until='networkidle')
             await self.take_screenshot('login-page')
             
             # Wait for email input - try multiple selector strategies
@@ -158,14 +248,17 @@ class SmokeBallReceiptAutomation:
                 print('🔐 2FA required...')
                 
                 try:
+                    two_factor_method = 'unknown'
                     await self.page.wait_for_selector('input[placeholder="Two-Factor Code"], textbox[name="Two-Factor Code"]', timeout=15000)
                     
                     two_factor_input = self.page.get_by_role('textbox', name='Two-Factor Code')
                     
                     # Get TOTP code
-                    if self.credentials['two_factor_secret'] and pyotp:
+                    if self.credentials['two_factor_secret'] and load_pyotp():
+                        two_factor_method = 'totp'
                         totp_code = self.generate_totp_code()
                     else:
+                        two_factor_method = 'manual'
                         print('⚠️ Manual 2FA required - please enter code:')
                         totp_code = input('Enter 2FA code: ')
                     
@@ -181,25 +274,56 @@ class SmokeBallReceiptAutomation:
                     # Wait for dashboard
                     await self.page.wait_for_url('**/dashboard', timeout=45000)
                     print('✅ 2FA verification successful')
+                    self.metrics.inc('two_factor_attempts_total', method=two_factor_method, outcome='success')
                 except Exception as e:
+                    self.metrics.inc('two_factor_attempts_total', method=two_factor_method, outcome='failure')
                     await self.take_screenshot('2fa-error')
                     raise Exception(f'2FA failed: {e}')
             
             print('✅ Successfully logged in')
+            self.metrics.inc('login_total', outcome='success')
         except Exception as e:
+            self.metrics.inc('login_total', outcome='failure')
             await self.take_screenshot('login-error')
             raise Exception(f'Login failed: {e}')
 
-    async def navigate_to_matter_transactions(self, matter_id, account_id):
+    def is_spa_loaded(self):
+        """True if the Smokeball app is already running in the page (e.g. after login)"""
+        return bool(self.page) and self.page.url.startswith(SMOKEBALL_APP_URL) and '#/' in self.page.url
+
+    async def navigate_to_matter_transactions(self, matter_id, account_id, spa=True):
         """Navigate to matter's trust account transactions page"""
+        import asyncio
+        
         print(f'📋 Navigating to matter transactions...')
         print(f'   Matter ID: {matter_id}')
         print(f'   Account ID: {account_id}')
         
-        transactions_url = f'https://app.smokeball.com.au/#/billing/view-matter/{matter_id}/transactions/trust/{account_id}~2FTrust'
+        transactions_route = f'#/billing/view-matter/{matter_id}/transactions/trust/{account_id}~2FTrust'
+        transactions_url = f'{SMOKEBALL_APP_URL}/{transactions_route}'
+        
+        navigation_mode = 'full'
+        
+        # If the app is already live, change only the hash route instead of re-bootstrapping it
+        if spa and self.is_spa_loaded() and self.page.url != transactions_url:
+            try:
+                await self.navigate_in_app(matter_id, transactions_route)
+                self.metrics.inc('navigation_total', mode='spa')
+                await self.take_screenshot('transactions-page-loaded')
+                return
+            except Exception as e:
+                print(f'⚠️ In-app navigation failed, falling back to full page load: {e}')
+                navigation_mode = 'spa_fallback'
         
-        print(f'🔗 Navigating to: {transactions_url}')
-        await self.page.goto(transactions_url)
+        if self.is_spa_loaded():
+            # Inside the loaded app goto() only changes the hash - force a real page load
+            print(f'🔄 Reloading: {transactions_url}')
+            if self.page.url != transactions_url:
+                await self.page.goto(transactions_url)
+            await self.page.reload()
+        else:
+            print(f'🔗 Navigating to: {transactions_url}')
+            await self.page.goto(transactions_url)
         
         # Wait for page to fully load - try multiple strategies
         print('⏳ Waiting for page to load...')
@@ -221,16 +345,42 @@ class SmokeBallReceiptAutomation:
             await self.take_screenshot('transactions-page-error')
             print(f'⚠️ Could not verify page content: {e}')
         
+        self.metrics.inc('navigation_total', mode=navigation_mode)
         await self.take_screenshot('transactions-page-loaded')
 
-    async def fill_receipt_form(self, receipt_data):
-        """Fill out the receipt form"""
-        print('💰 Filling receipt form...')
-        print(f'📋 Receipt details: {receipt_data}')
+    async def navigate_in_app(self, matter_id, transactions_route, timeout=15000):
+        """Switch the SPA's hash route and wait for this matter's transactions grid"""
+        print(f'⚡ Navigating in-app to: {transactions_route}')
         
-        await self.take_screenshot('before-fill-form')
+        # Remember what is on screen now so the previous matter's grid isn't mistaken for the new one
+        old_grid = await self.page.query_selector(TRANSACTIONS_GRID_SELECTOR)
+        old_text = await old_grid.inner_text() if old_grid else None
+        
+        # The app fetches this matter's data once the route changes. Waiting for that
+        # response ties the grid checked below to this matter, not to whatever was on screen.
+        async with self.page.expect_response(
+            lambda response: matter_id in response.url and response.ok, timeout=timeout
+        ):
+            await self.page.evaluate('route => { window.location.hash = route }', transactions_route)
+        
+        # Then wait for a settled grid with data rows that is not the previous matter's grid.
+        # A matter with no transactions never gets rows and falls back to a full page load.
+        await self.page.wait_for_function(
+            """([selector, rowSelector, oldGrid, oldText]) => {
+                const grid = document.querySelector(selector);
+                if (!grid || grid.getAttribute('aria-busy') === 'true') return false;
+                if (grid.querySelectorAll(rowSelector).length === 0) return false;
+                return grid !== oldGrid || grid.innerText !== oldText;
+            }""",
+            arg=[TRANSACTIONS_GRID_SELECTOR, TRANSACTIONS_ROW_SELECTOR, old_grid, old_text],
+            timeout=timeout
+        )
+        print('✅ Transactions grid rendered for this matter')
+
+    async def open_deposit_dialog(self):
+        """Open the "Deposit Funds" dialog, returning the name of the strategy that worked"""
+        import asyncio
         
-        # Click "Deposit Funds" button - try multiple selector strategies
         print('🔘 Clicking "Deposit Funds" button...')
         deposit_button = None
         
@@ -251,7 +401,7 @@ class SmokeBallReceiptAutomation:
                         await deposit_button.click()
                         await asyncio.sleep(2)
                         await self.take_screenshot('deposit-dialog-opened')
-                        return
+                        return 'create_new_menu'
                 except:
                     # Try finding by text in any menu item
                     menu_items = await self.page.locator('[role="menuitem"], [role="option"], li, a').all()
@@ -263,7 +413,7 @@ class SmokeBallReceiptAutomation:
                                 await item.click()
                                 await asyncio.sleep(2)
                                 await self.take_screenshot('deposit-dialog-opened')
-                                return
+                                return 'create_new_menu_text'
                         except:
                             continue
         except Exception as e:
@@ -277,7 +427,7 @@ class SmokeBallReceiptAutomation:
                 await deposit_button.click()
                 await asyncio.sleep(2)
                 await self.take_screenshot('deposit-dialog-opened')
-                return
+                return 'exact_name'
         except Exception as e:
             print(f'⚠️ Strategy 2 failed: {e}')
         
@@ -289,7 +439,7 @@ class SmokeBallReceiptAutomation:
                 await deposit_button.click()
                 await asyncio.sleep(2)
                 await self.take_screenshot('deposit-dialog-opened')
-                return
+                return 'case_insensitive'
         except Exception as e:
             print(f'⚠️ Strategy 3 failed: {e}')
         
@@ -301,7 +451,7 @@ class SmokeBallReceiptAutomation:
                 await deposit_button.click()
                 await asyncio.sleep(2)
                 await self.take_screenshot('deposit-dialog-opened')
-                return
+                return 'has_text'
         except Exception as e:
             print(f'⚠️ Strategy 4 failed: {e}')
         
@@ -318,7 +468,7 @@ class SmokeBallReceiptAutomation:
                         await button.click()
                         await asyncio.sleep(2)
                         await self.take_screenshot('deposit-dialog-opened')
-                        return
+                        return 'button_scan'
                 except:
                     continue
         except Exception as e:
@@ -332,7 +482,7 @@ class SmokeBallReceiptAutomation:
                 await deposit_button.click()
                 await asyncio.sleep(2)
                 await self.take_screenshot('deposit-dialog-opened')
-                return
+                return 'aria_label'
         except Exception as e:
             print(f'⚠️ Strategy 6 failed: {e}')
         
@@ -344,13 +494,33 @@ class SmokeBallReceiptAutomation:
                 await deposit_button.click()
                 await asyncio.sleep(2)
                 await self.take_screenshot('deposit-dialog-opened')
-                return
+                return 'data_attributes'
         except Exception as e:
             print(f'⚠️ Strategy 7 failed: {e}')
         
         # If all strategies failed, take screenshot and raise error
         await self.take_screenshot('deposit-button-not-found')
         raise Exception('Could not find "Deposit Funds" button after trying all strategies')
+
+    async def fill_receipt_form(self, receipt_data):
+        """Fill out the receipt form"""
+        import asyncio
+        
+        print('💰 Filling receipt form...')
+        print(f'📋 Receipt details: {receipt_data}')
+        
+        await self.take_screenshot('before-fill-form')
+        
+        # Click "Deposit Funds" button - try multiple selector strategies
+        try:
+            strategy = await self.open_deposit_dialog()
+        except Exception:
+            self.metrics.inc('deposit_strategy_total', strategy='none')
+            raise
+        self.metrics.inc('deposit_strategy_total', strategy=strategy)
+        self.dialog_open = True
+        self.emit('dialog_opened', strategy=strategy)
+        await self.trace_step('fill_fields')
         
         # Fill Date Deposited - Use label to find the input
         print(f'📅 Filling date: {receipt_data["date"]}')
@@ -363,6 +533,7 @@ class SmokeBallReceiptAutomation:
             await date_input.fill(receipt_data['date'])
             await asyncio.sleep(0.5)
             print('✅ Date filled')
+            self.record_field('date', 'primary')
         except Exception as e:
             print(f'⚠️ Could not fill date field with label method: {e}')
             # Try alternative: find all text inputs and use the first one
@@ -372,8 +543,10 @@ class SmokeBallReceiptAutomation:
                     await date_inputs[0].click()
                     await date_inputs[0].fill(receipt_data['date'])
                     print('✅ Date filled (alternative selector)')
+                    self.record_field('date', 'fallback')
             except Exception as e2:
                 print(f'❌ Failed to fill date: {e2}')
+                self.record_field('date', 'failed')
         
         # Fill Received From (lastname, firstname format)
         print(f'👤 Filling Received From: {receipt_data["lastname"]}, {receipt_data["firstname"]}')
@@ -404,14 +577,17 @@ class SmokeBallReceiptAutomation:
                 if await contact_option.is_visible(timeout=2000):
                     await contact_option.click()
                     print(f'✅ Selected contact from dropdown: {contact_name}')
+                    self.record_field('received_from', 'primary')
                 else:
                     # Try pressing Enter to select
                     await received_from_input.press('Enter')
                     await asyncio.sleep(0.5)
                     print(f'✅ Entered contact name: {contact_name}')
+                    self.record_field('received_from', 'typed')
             except Exception as e:
                 # If selection fails, just leave the typed text
                 print(f'⚠️ Could not select from dropdown, leaving typed text: {contact_name}')
+                self.record_field('received_from', 'typed')
             
         except Exception as e:
             print(f'⚠️ Could not fill Received From field: {e}')
@@ -423,8 +599,10 @@ class SmokeBallReceiptAutomation:
                     await comboboxes[0].fill(contact_name)
                     await asyncio.sleep(1)
                     print('✅ Received From filled (alternative selector)')
+                    self.record_field('received_from', 'fallback')
             except Exception as e2:
                 print(f'❌ Failed to fill Received From: {e2}')
+                self.record_field('received_from', 'failed')
         
         # Fill Reason
         if receipt_data.get('reason'):
@@ -437,6 +615,7 @@ class SmokeBallReceiptAutomation:
                 await reason_input.fill(receipt_data['reason'])
                 await asyncio.sleep(0.5)
                 print('✅ Reason filled')
+                self.record_field('reason', 'primary')
             except Exception as e:
                 print(f'⚠️ Could not fill reason field: {e}')
                 # Try finding all text inputs and using one that's not the date
@@ -450,11 +629,13 @@ class SmokeBallReceiptAutomation:
                                 await inp.click()
                                 await inp.fill(receipt_data['reason'])
                                 print(f'✅ Reason filled (input #{i})')
+                                self.record_field('reason', 'fallback')
                                 break
                         except:
                             continue
                 except Exception as e2:
                     print(f'❌ Failed to fill reason: {e2}')
+                    self.record_field('reason', 'failed')
         
         # Fill Amount in the Allocated Matters section
         print(f'💰 Filling amount: ${receipt_data["amount"]}')
@@ -469,6 +650,7 @@ class SmokeBallReceiptAutomation:
             await amount_input.fill(str(receipt_data['amount']))
             await asyncio.sleep(0.5)
             print('✅ Amount filled')
+            self.record_field('amount', 'primary')
         except Exception as e:
             print(f'⚠️ Could not fill amount field: {e}')
             # Try alternative: find spinbutton directly
@@ -479,8 +661,10 @@ class SmokeBallReceiptAutomation:
                     await spinbuttons[-1].click()
                     await spinbuttons[-1].fill(str(receipt_data['amount']))
                     print('✅ Amount filled (alternative selector)')
+                    self.record_field('amount', 'fallback')
             except Exception as e2:
                 print(f'❌ Failed to fill amount: {e2}')
+                self.record_field('amount', 'failed')
         
         # Wait a moment for form to update
         await asyncio.sleep(1)
@@ -507,67 +691,207 @@ class SmokeBallReceiptAutomation:
             print(f'   - Matter: Pre-filled')
             print('\n⚠️ To actually create the receipt, run without --test-mode flag')
             print('='*60)
-            
-            # Keep browser open for inspection
-            print('\n⏸️ Keeping browser open for 30 seconds for inspection...')
-            print('   Press Ctrl+C to close early')
-            try:
-                await asyncio.sleep(30)
-            except KeyboardInterrupt:
-                print('\n⚠️ Interrupted by user')
+            self.emit('form_filled')
         else:
             # Click "Process/Open Receipt" button
+            await self.trace_step('submit')
             print('💾 Clicking "Process/Open Receipt" button...')
             try:
                 process_button = self.page.get_by_role('button', name='Process/Open Receipt')
                 await process_button.click()
-                await asyncio.sleep(3)
-                await self.take_screenshot('after-submit')
+                self.emit('submitted')
+                
+                # The dialog closes once Smokeball has created the receipt
+                try:
+                    await process_button.wait_for(state='hidden', timeout=15000)
+                except Exception:
+                    await self.take_screenshot('after-submit')
+                    raise Exception('Receipt not confirmed - dialog still open after submitting. '
+                                    'Check Smokeball before retrying to avoid a duplicate receipt')
+                self.dialog_open = False
+                self.emit('confirmed')
                 print('✅ Receipt submitted!')
             except Exception as e:
                 print(f'❌ Failed to submit receipt: {e}')
                 raise
 
+    def emit(self, event, **data):
+        """Send a progress event to the caller (no-op without an event stream)"""
+        if self.events:
+            self.events.emit(event, **data)
+
+    def record_field(self, field, method):
+        """Record how a form field was filled (primary, fallback, typed or failed)"""
+        self.metrics.inc('field_fill_total', field=field, method=method)
+        self.emit('field_filled', field=field, method=method)
+
+    async def trace_step(self, name):
+        """Start a new rolling-trace chunk (no-op without tracing)"""
+        if not self.trace:
+            return
+        try:
+            await self.trace.step(name)
+        except Exception as e:
+            # Tracing is a debugging aid - never let it fail the receipt run
+            print(f'⚠️ Failed to start trace step "{name}", falling back to screenshots: {e}')
+            trace, self.trace = self.trace, None
+            try:
+                await trace.discard()
+            except Exception:
+                pass
+
+    async def inspection_pause(self, seconds=30):
+        """Keep the browser open after a test-mode run so the filled form can be inspected"""
+        import asyncio
+        
+        print(f'\n⏸️ Keeping browser open for {seconds} seconds for inspection...')
+        print('   Press Ctrl+C to close early')
+        try:
+            await asyncio.sleep(seconds)
+        except KeyboardInterrupt:
+            print('\n⚠️ Interrupted by user')
+
     async def cleanup(self):
         """Clean up browser resources"""
+        if self.trace:
+            try:
+                await self.trace.discard()
+            except Exception as e:
+                print(f'⚠️ Failed to stop trace: {e}')
         if self.browser:
             await self.browser.close()
             print('🧹 Browser closed')
 
-    async def run(self, matter_id, receipt_data):
-        """Run the automation"""
-        try:
+    async def start_session(self):
+        """Launch the browser and log in; process() reuses the logged-in page for later receipts"""
+        if self.browser:
+            await self.end_session()
+        mode = 'test' if self.test_mode else 'submit'
+        with self.metrics.time('phase_duration_seconds', phase='initialize', mode=mode):
             await self.initialize()
+        self.emit('browser_ready')
+        await self.trace_step('login')
+        with self.metrics.time('phase_duration_seconds', phase='login', mode=mode):
             await self.login()
+        self.emit('authenticated')
+        self.session_active = True
+
+    async def end_session(self):
+        """Close the browser; the next process() call starts a new session"""
+        try:
+            await self.cleanup()
+        finally:
+            self.browser = self.context = self.page = None
+            self.session_active = False
+            self.dialog_open = False
+
+    async def close_receipt_dialog(self):
+        """Dismiss the receipt dialog a test-mode run left open, so the next matter starts clean"""
+        try:
+            await self.page.keyboard.press('Escape')
+            await self.page.get_by_role('button', name='Process/Open Receipt').wait_for(state='hidden', timeout=5000)
+            print('✅ Closed previous receipt dialog')
+            return True
+        except Exception as e:
+            print(f'⚠️ Could not close previous receipt dialog, using a full page load: {e}')
+            return False
+        finally:
+            self.dialog_open = False
+
+    async def process(self, matter_id, receipt_data):
+        """
+        Create one receipt in the current session, starting (or restarting) it if needed.
+
+        The browser stays open afterwards, so the next call moves to its matter with in-app
+        navigation instead of a new browser and login. A failed receipt ends the session,
+        since the page may be left in an unknown state. Call end_session() when done.
+        """
+        mode = 'test' if self.test_mode else 'submit'
+        started = time.perf_counter()
+        success = False
+        self.emit('started', matter_id=matter_id, test_mode=self.test_mode)
+        try:
+            spa = self.spa_navigation
+            if not self.session_active:
+                await self.start_session()
+            elif self.dialog_open and not await self.close_receipt_dialog():
+                spa = False
             
             account_id = '34154dcb-8a76-4f8c-9281-a9b80e3cca16'  # Trust account ID
-            await self.navigate_to_matter_transactions(matter_id, account_id)
-            await self.fill_receipt_form(receipt_data)
+            await self.trace_step('navigate')
+            with self.metrics.time('phase_duration_seconds', phase='navigate', mode=mode):
+                await self.navigate_to_matter_transactions(matter_id, account_id, spa=spa)
+            self.emit('navigated')
+            await self.trace_step('fill_form')
+            with self.metrics.time('phase_duration_seconds', phase='fill_form', mode=mode):
+                await self.fill_receipt_form(receipt_data)
             
+            success = True
             print('🎉 Automation completed successfully!')
-            return {
+            result = {
                 'success': True,
                 'message': 'Receipt form filled successfully' if self.test_mode else 'Receipt created successfully'
             }
+            # Terminal event goes out before the screenshot, pre-close pauses and cleanup
+            self.emit('completed', **result)
+            if not self.test_mode:
+                await self.take_screenshot('after-submit')
+            return result
             
         except Exception as e:
             print(f'❌ Automation failed: {e}')
-            await self.take_screenshot('automation-error')
-            return {
+            result = {
                 'success': False,
                 'error': str(e),
                 'message': 'Failed to fill receipt form' if self.test_mode else 'Failed to create receipt'
             }
+            self.emit('failed', **result)
+            if self.page:
+                await self.take_screenshot('automation-error')
+            if self.trace:
+                try:
+                    await self.trace.save_failure(e)
+                except Exception as trace_error:
+                    print(f'⚠️ Failed to save trace: {trace_error}')
+            # Don't build on a page in an unknown state - the next receipt starts a fresh session
+            self.session_active = False
+            return result
         finally:
-            if not self.test_mode:
+            duration = time.perf_counter() - started
+            self.metrics.inc('runs_total', outcome='success' if success else 'failure', mode=mode)
+            self.metrics.observe('phase_duration_seconds', duration, phase='total', mode=mode)
+            self.metrics.set('last_run_duration_seconds', duration, mode=mode)
+            self.metrics.set('last_run_timestamp_seconds', time.time(), mode=mode)
+            if success:
+                self.metrics.set('last_success_timestamp_seconds', time.time(), mode=mode)
+            try:
+                if self.metrics.flush():
+                    print(f'📈 Metrics written: {self.metrics.path}')
+            except Exception as e:
+                print(f'⚠️ Failed to write metrics: {e}')
+
+    async def run(self, matter_id, receipt_data):
+        """Run the automation for a single receipt in its own browser session"""
+        import asyncio
+        
+        try:
+            result = await self.process(matter_id, receipt_data)
+            if self.test_mode and result['success'] and self.inspection_seconds:
+                await self.inspection_pause(self.inspection_seconds)
+            elif not self.test_mode:
                 await asyncio.sleep(5)  # Wait a moment before closing
-            await self.cleanup()
+            return result
+        finally:
+            await self.end_session()
 
 
-async def main():
-    """Main entry point"""
+def parse_args(argv=None):
+    """Parse command line arguments"""
     import argparse
     
+    # Environment defaults below (metrics file, tracing) may come from .env
+    load_env()
+    
     parser = argparse.ArgumentParser(description='Smokeball Receipt Automation')
     parser.add_argument('--matter-id', default='ce2582fe-b415-4f95-b9b9-c79c903a4654',
                        help='Matter ID (default: ce2582fe-b415-4f95-b9b9-c79c903a4654)')
@@ -585,8 +909,93 @@ async def main():
                        help='Test mode - fill form but do not submit (default: True)')
     parser.add_argument('--submit', action='store_true',
                        help='Actually submit the receipt (overrides test-mode)')
+    parser.add_argument('--trace-on-failure', action='store_true',
+                       default=os.getenv('SMOKEBALL_TRACE_ON_FAILURE') == 'true',
+                       help='Keep a rolling Playwright trace and save it to traces/ only if the run fails (replaces screenshots)')
+    parser.add_argument('--trace-steps', type=int, default=3,
+                       help='Number of most recent steps kept in the trace buffer (default: 3)')
+    parser.add_argument('--trace-seconds', type=float,
+                       default=float(os.getenv('SMOKEBALL_TRACE_SECONDS', '0')) or None,
+                       help='Also drop buffered steps older than this many seconds (default: $SMOKEBALL_TRACE_SECONDS, no limit)')
+    parser.add_argument('--inspection-seconds', type=float, default=30,
+                       help='Keep the browser open this long after a test-mode run, 0 to skip (default: 30)')
+    parser.add_argument('--full-reload', action='store_true',
+                       help='Always load the transactions page with a full page load instead of in-app navigation')
+    parser.add_argument('--metrics-file', default=os.getenv('SMOKEBALL_METRICS_FILE'),
+                       help='Prometheus textfile to merge run metrics into (default: $SMOKEBALL_METRICS_FILE)')
+    parser.add_argument('--events', action='store_true',
+                       help='Write NDJSON progress events to stdout (human-readable output goes to stderr)')
+    parser.add_argument('--check', action='store_true',
+                       help='Validate configuration and arguments without starting a browser, then exit')
     
-    args = parser.parse_args()
+    return parser.parse_args(argv)
+
+
+def check_config(args):
+    """Validate environment, dependencies and arguments without importing Playwright"""
+    import base64
+    import importlib.util
+    import re
+    
+    load_env()
+    errors = []
+    warnings = []
+    
+    for name in ('SMOKEBALL_USERNAME', 'SMOKEBALL_PASSWORD'):
+        if not os.getenv(name):
+            warnings.append(f'{name} not set - using built-in default')
+    
+    secret = os.getenv('SMOKEBALL_2FA_SECRET')
+    if not secret:
+        warnings.append('SMOKEBALL_2FA_SECRET not set - 2FA will require manual input')
+    else:
+        try:
+            base64.b32decode(secret.replace(' ', '').upper() + '=' * (-len(secret.replace(' ', '')) % 8))
+        except ValueError:
+            errors.append('SMOKEBALL_2FA_SECRET is not valid base32')
+        if not importlib.util.find_spec('pyotp'):
+            errors.append('pyotp not installed (pip install pyotp) - required for SMOKEBALL_2FA_SECRET')
+    
+    if not importlib.util.find_spec('playwright'):
+        errors.append('Playwright not installed (pip install playwright && playwright install chromium)')
+    
+    if not re.fullmatch(r'[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}', args.matter_id):
+        errors.append(f'--matter-id is not a valid UUID: {args.matter_id}')
+    if args.amount <= 0:
+        errors.append(f'--amount must be positive: {args.amount}')
+    for date_format in ('%d/%m/%Y', '%d/%m/%Y %H:%M:%S'):
+        try:
+            datetime.strptime(args.date, date_format)
+            break
+        except ValueError:
+            continue
+    else:
+        errors.append(f'--date must be DD/MM/YYYY or DD/MM/YYYY HH:MM:SS: {args.date}')
+    
+    if args.metrics_file:
+        metrics_dir = os.path.dirname(os.path.abspath(args.metrics_file))
+        if os.path.isdir(metrics_dir) and not os.access(metrics_dir, os.W_OK):
+            errors.append(f'Metrics directory is not writable: {metrics_dir}')
+    
+    for warning in warnings:
+        print(f'⚠️ {warning}')
+    for error in errors:
+        print(f'❌ {error}')
+    if not errors:
+        print('✅ Configuration OK')
+    return not errors
+
+
+async def main(args=None):
+    """Main entry point"""
+    if args is None:
+        args = parse_args()
+    
+    events = None
+    if args.events:
+        # Keep stdout for events only; everything printed goes to stderr
+        events = EventStream(sys.stdout)
+        sys.stdout = sys.stderr
     
     test_mode = args.test_mode and not args.submit
     
@@ -609,7 +1018,13 @@ async def main():
     print(f'🧪 Test Mode: {test_mode}')
     print()
     
-    automation = SmokeBallReceiptAutomation(test_mode=test_mode)
+    trace = None
+    if args.trace_on_failure:
+        from receipt_trace import RollingTrace
+        trace = RollingTrace(keep_steps=args.trace_steps, keep_seconds=args.trace_seconds)
+    automation = SmokeBallReceiptAutomation(test_mode=test_mode, metrics=ReceiptMetrics(args.metrics_file), trace=trace,
+                                            spa_navigation=not args.full_reload, events=events,
+                                            inspection_seconds=args.inspection_seconds)
     result = await automation.run(args.matter_id, receipt_data)
     
     print('\n📊 Final Result:', result)
@@ -617,8 +1032,13 @@ async def main():
 
 
 if __name__ == '__main__':
+    cli_args = parse_args()
+    if cli_args.check:
+        sys.exit(0 if check_config(cli_args) else 1)
+    
     try:
-        asyncio.run(main())
+        import asyncio
+        asyncio.run(main(cli_args))
     except KeyboardInterrupt:
         print('\n⚠️ Interrupted by user')
         sys.exit(1)
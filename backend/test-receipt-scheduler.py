@@ -0,0 +1,249 @@
+"""
+Test Receipt Job Scheduler
+
+This script checks the scheduler's queue logic against a temporary SQLite
+file: job ordering (priority classes and deadline promotion), coalescing of
+duplicate receipts, the global rate limit, recovery of abandoned jobs and
+that finish() never overwrites a job recovery has released.
+No browser or Smokeball access is needed.
+
+Usage:
+    python test-receipt-scheduler.py
+"""
+
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from receipt_scheduler import ReceiptScheduler
+
+
+def receipt(amount, lastname='Stanford'):
+    return {'amount': amount, 'date': '21/11/2025', 'lastname': lastname, 'firstname': 'Logan'}
+
+
+def new_scheduler(tmp_dir, **kwargs):
+    kwargs.setdefault('min_interval', 0)
+    return ReceiptScheduler(os.path.join(tmp_dir, 'queue.sqlite3'), **kwargs)
+
+
+def claim_order(scheduler):
+    order = []
+    while True:
+        job, _ = scheduler.claim_next()
+        if not job:
+            return order
+        order.append(job['id'])
+        scheduler.finish(job, {'success': True})
+
+
+def check(condition, ok_message, error_message):
+    print(f"[OK] {ok_message}" if condition else f"[ERROR] {error_message}")
+    return condition
+
+
+def test_ordering():
+    """Priority classes run in order; jobs near their deadline are promoted"""
+    print("[TEST] Testing job ordering")
+    print("=" * 60)
+
+    passed = True
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        scheduler = new_scheduler(tmp_dir)
+        bulk = scheduler.enqueue('m1', receipt(1), priority='bulk')
+        normal = scheduler.enqueue('m2', receipt(2), priority='normal')
+        urgent = scheduler.enqueue('m3', receipt(3), priority='urgent')
+        order = claim_order(scheduler)
+        passed &= check(order == [urgent, normal, bulk],
+                        "urgent -> normal -> bulk",
+                        f"Expected {[urgent, normal, bulk]}, got {order}")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        scheduler = new_scheduler(tmp_dir, urgent_window=900)
+        now = time.time()
+        urgent = scheduler.enqueue('m1', receipt(1), priority='urgent')
+        far_bulk = scheduler.enqueue('m2', receipt(2), priority='bulk', deadline=now + 86400)
+        due_later = scheduler.enqueue('m3', receipt(3), priority='bulk', deadline=now + 600)
+        due_soon = scheduler.enqueue('m4', receipt(4), priority='normal', deadline=now + 60)
+        normal = scheduler.enqueue('m5', receipt(5), priority='normal')
+        order = claim_order(scheduler)
+        expected = [due_soon, due_later, urgent, normal, far_bulk]
+        passed &= check(order == expected,
+                        "Jobs due within the urgent window run first, earliest deadline first",
+                        f"Expected {expected}, got {order}")
+    return passed
+
+
+def test_coalescing():
+    """Identical receipts merge into the pending or running job"""
+    print("\n" + "=" * 60)
+    print("[TEST] Testing coalescing")
+    print("=" * 60)
+
+    passed = True
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        scheduler = new_scheduler(tmp_dir)
+        deadline = time.time() + 3600
+        first = scheduler.enqueue('m1', receipt(10), priority='bulk')
+        second = scheduler.enqueue('m1', receipt(10), priority='urgent', deadline=deadline)
+        job = scheduler.conn.execute('SELECT * FROM jobs WHERE id = ?', (first,)).fetchone()
+        passed &= check(first == second, "Duplicate returns the existing job",
+                        f"Duplicate created job #{second}")
+        passed &= check(job['priority'] == 0 and job['deadline'] == deadline and job['coalesced'] == 1,
+                        "Coalesced job keeps the higher priority and earlier deadline",
+                        f"Got priority={job['priority']} deadline={job['deadline']} coalesced={job['coalesced']}")
+
+        other = scheduler.enqueue('m1', receipt(11))
+        passed &= check(other != first, "Different amount creates a new job",
+                        "Different amount was coalesced")
+        submit = scheduler.enqueue('m1', receipt(10), test_mode=False)
+        passed &= check(submit != first, "Submit and test-mode jobs are kept apart",
+                        "Submit job was coalesced into a test-mode job")
+
+        running, _ = scheduler.claim_next()
+        again = scheduler.enqueue(running['matter_id'], receipt(10))
+        passed &= check(again == running['id'], "Duplicate of a running job returns the running job",
+                        f"Duplicate of running job #{running['id']} created job #{again}")
+
+        scheduler.finish(running, {'success': True})
+        after = scheduler.enqueue(running['matter_id'], receipt(10))
+        passed &= check(after != running['id'], "Finished jobs are not coalesced into",
+                        "Duplicate was coalesced into a finished job")
+    return passed
+
+
+def test_rate_limit():
+    """Only one job starts per min_interval"""
+    print("\n" + "=" * 60)
+    print("[TEST] Testing rate limit")
+    print("=" * 60)
+
+    passed = True
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        scheduler = new_scheduler(tmp_dir, min_interval=60)
+        scheduler.enqueue('m1', receipt(1))
+        scheduler.enqueue('m2', receipt(2))
+        first, _ = scheduler.claim_next()
+        second, wait = scheduler.claim_next()
+        passed &= check(first is not None and second is None and 55 < wait <= 60,
+                        f"Second claim is held back for {wait:.1f}s",
+                        f"Got first={first} second={second} wait={wait}")
+
+        other_worker = new_scheduler(tmp_dir, min_interval=60)
+        job, wait = other_worker.claim_next()
+        passed &= check(job is None and wait > 0, "Rate limit is shared between workers",
+                        "Another worker ignored the rate limit")
+        pending = scheduler.stats()['depth']['normal']
+        passed &= check(pending == 1, "Held-back job stays pending",
+                        f"Expected 1 pending job, got {pending}")
+    return passed
+
+
+def test_recovery():
+    """Jobs of dead workers are released; live local workers are never timed out"""
+    print("\n" + "=" * 60)
+    print("[TEST] Testing recovery of abandoned jobs")
+    print("=" * 60)
+
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    dead_worker = f'{socket.gethostname()}:{process.pid}'
+    remote_worker = 'other-host.example:1234'
+
+    passed = True
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        scheduler = new_scheduler(tmp_dir, stale_after=600)
+        test_job = scheduler.enqueue('m1', receipt(1))
+        submit_job = scheduler.enqueue('m2', receipt(2), test_mode=False)
+        live_job = scheduler.enqueue('m3', receipt(3))
+        slow_job = scheduler.enqueue('m4', receipt(4))
+        remote_job = scheduler.enqueue('m5', receipt(5))
+        remote_stale_job = scheduler.enqueue('m6', receipt(6))
+        now = time.time()
+        for job_id, worker, started in ((test_job, dead_worker, now), (submit_job, dead_worker, now),
+                                        (live_job, scheduler.worker_id, now),
+                                        (slow_job, scheduler.worker_id, now - 3600),
+                                        (remote_job, remote_worker, now),
+                                        (remote_stale_job, remote_worker, now - 3600)):
+            scheduler.conn.execute(
+                "UPDATE jobs SET status = 'running', started_at = ?, worker = ? WHERE id = ?",
+                (started, worker, job_id)
+            )
+
+        again = scheduler.enqueue('m1', receipt(1))
+        status = {row['id']: row['status'] for row in scheduler.conn.execute('SELECT id, status FROM jobs')}
+        passed &= check(again == test_job and status[test_job] == 'pending',
+                        "Dead worker's test-mode job is requeued before coalescing",
+                        f"Got job #{again}, status {status[test_job]}")
+        passed &= check(status[submit_job] == 'failed', "Dead worker's submit job is marked failed",
+                        f"Submit job status {status[submit_job]}")
+        passed &= check(status[live_job] == 'running', "Live worker's job is left alone",
+                        f"Live job status {status[live_job]}")
+        passed &= check(status[slow_job] == 'running', "Live local worker's slow job is not timed out",
+                        f"Slow job status {status[slow_job]}")
+        passed &= check(status[remote_job] == 'running', "Unverifiable worker's recent job is left alone",
+                        f"Remote job status {status[remote_job]}")
+        passed &= check(status[remote_stale_job] == 'pending',
+                        "Unverifiable worker's job past stale_after is requeued",
+                        f"Remote stale job status {status[remote_stale_job]}")
+    return passed
+
+
+def test_finish_after_recovery():
+    """finish() must not overwrite a job that recovery has released"""
+    print("\n" + "=" * 60)
+    print("[TEST] Testing finish() of a released job")
+    print("=" * 60)
+
+    passed = True
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        scheduler = new_scheduler(tmp_dir)
+        scheduler.enqueue('m1', receipt(1), test_mode=False)
+        job, _ = scheduler.claim_next()
+        scheduler.conn.execute(
+            "UPDATE jobs SET status = 'failed', error = 'Worker interrupted' WHERE id = ?", (job['id'],)
+        )
+        recorded = scheduler.finish(job, {'success': True})
+        row = scheduler.conn.execute('SELECT status, error FROM jobs WHERE id = ?', (job['id'],)).fetchone()
+        passed &= check(not recorded and row['status'] == 'failed' and row['error'] == 'Worker interrupted',
+                        "Released job keeps the recovery outcome",
+                        f"finish() returned {recorded}, job is now {row['status']} ({row['error']})")
+
+        scheduler.enqueue('m2', receipt(2))
+        job, _ = scheduler.claim_next()
+        recorded = scheduler.finish(job, {'success': True})
+        row = scheduler.conn.execute('SELECT status FROM jobs WHERE id = ?', (job['id'],)).fetchone()
+        passed &= check(recorded and row['status'] == 'succeeded', "Owned job is finished normally",
+                        f"finish() returned {recorded}, job is now {row['status']}")
+    return passed
+
+
+if __name__ == '__main__':
+    print("\n" + "=" * 60)
+    print("[START] Receipt Job Scheduler Test")
+    print("=" * 60 + "\n")
+
+    results = {
+        'Job Ordering': test_ordering(),
+        'Coalescing': test_coalescing(),
+        'Rate Limit': test_rate_limit(),
+        'Recovery': test_recovery(),
+        'Finish After Recovery': test_finish_after_recovery(),
+    }
+
+    print("\n" + "=" * 60)
+    print("[SUMMARY] Test Summary")
+    print("=" * 60)
+    for name, result in results.items():
+        print(f"   {name}: {'[PASS]' if result else '[FAIL]'}")
+
+    if all(results.values()):
+        print("\n[SUCCESS] All tests passed! Scheduler queue logic is working.")
+        sys.exit(0)
+    else:
+        print("\n[WARNING] Some tests failed. Please check the errors above.")
+        sys.exit(1)
@@ -0,0 +1,135 @@
+"""
+Test Startup Budget for Smokeball Automation
+
+This script checks that importing smokeball_receipt_automation and running
+--check stay fast: Playwright, pyotp, python-dotenv and asyncio must not be
+imported until a browser is actually needed, and importing must not create
+files or directories.
+
+Usage:
+    python test-startup-time.py
+
+Environment:
+    STARTUP_BUDGET_MS - import / --check budget in milliseconds (default: 100)
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+MODULE = 'smokeball_receipt_automation'
+HEAVY_MODULES = ('playwright', 'pyotp', 'dotenv', 'asyncio')
+BUDGET_MS = float(os.getenv('STARTUP_BUDGET_MS', '100'))
+
+
+def run_python(args, cwd):
+    env = dict(os.environ, PYTHONPATH=SCRIPT_DIR)
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable] + args, cwd=cwd, env=env, capture_output=True, text=True)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def test_import_time():
+    """Measure the import with -X importtime and look for heavy dependencies"""
+    print("[TEST] Testing import time (-X importtime)")
+    print("=" * 60)
+
+    with tempfile.TemporaryDirectory() as cwd:
+        result, _ = run_python(['-X', 'importtime', '-c', f'import {MODULE}'], cwd)
+    if result.returncode != 0:
+        print(f"[ERROR] Import failed:\n{result.stderr}")
+        return False
+
+    imported = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        parts = [part.strip() for part in line[len('import time:'):].split('|')]
+        if parts[1].isdigit():
+            imported[parts[2]] = int(parts[1])
+
+    passed = True
+    heavy = sorted(name for name in imported if name.split('.')[0] in HEAVY_MODULES)
+    if heavy:
+        print(f"[ERROR] Heavy modules imported eagerly: {', '.join(heavy)}")
+        passed = False
+    else:
+        print(f"[OK] None of {', '.join(HEAVY_MODULES)} imported")
+
+    cumulative_ms = imported.get(MODULE, 0) / 1000
+    if cumulative_ms > BUDGET_MS:
+        print(f"[ERROR] Import took {cumulative_ms:.1f} ms (budget {BUDGET_MS:.0f} ms)")
+        passed = False
+    else:
+        print(f"[OK] Import took {cumulative_ms:.1f} ms (budget {BUDGET_MS:.0f} ms)")
+    return passed
+
+
+def test_no_side_effects():
+    """Importing and constructing the class must not touch the filesystem"""
+    print("\n" + "=" * 60)
+    print("[TEST] Testing import and construction side effects")
+    print("=" * 60)
+
+    with tempfile.TemporaryDirectory() as cwd:
+        code = f'import {MODULE}; {MODULE}.SmokeBallReceiptAutomation(test_mode=True)'
+        result, _ = run_python(['-c', code], cwd)
+        created = os.listdir(cwd)
+    if result.returncode != 0:
+        print(f"[ERROR] Construction failed:\n{result.stderr}")
+        return False
+    if created:
+        print(f"[ERROR] Files created on import/construction: {', '.join(created)}")
+        return False
+    print("[OK] No files or directories created")
+    return True
+
+
+def test_check_entry_point():
+    """--check should finish well inside the budget (on top of interpreter startup)"""
+    print("\n" + "=" * 60)
+    print("[TEST] Testing --check entry point")
+    print("=" * 60)
+
+    with tempfile.TemporaryDirectory() as cwd:
+        _, baseline_ms = run_python(['-c', 'pass'], cwd)
+        result, check_ms = run_python([os.path.join(SCRIPT_DIR, f'{MODULE}.py'), '--check'], cwd)
+
+    if 'Configuration OK' not in result.stdout and '❌' not in result.stdout:
+        print(f"[ERROR] --check produced no result:\n{result.stdout}{result.stderr}")
+        return False
+    print(f"[OK] --check exited with code {result.returncode}")
+
+    overhead_ms = check_ms - baseline_ms
+    if overhead_ms > BUDGET_MS:
+        print(f"[ERROR] --check took {overhead_ms:.1f} ms over interpreter startup (budget {BUDGET_MS:.0f} ms)")
+        return False
+    print(f"[OK] --check took {overhead_ms:.1f} ms over interpreter startup (budget {BUDGET_MS:.0f} ms)")
+    return True
+
+
+if __name__ == '__main__':
+    print("\n" + "=" * 60)
+    print("[START] Smokeball Automation Startup Budget Test")
+    print("=" * 60 + "\n")
+
+    test1_result = test_import_time()
+    test2_result = test_no_side_effects()
+    test3_result = test_check_entry_point()
+
+    print("\n" + "=" * 60)
+    print("[SUMMARY] Test Summary")
+    print("=" * 60)
+    print(f"   Import Time: {'[PASS]' if test1_result else '[FAIL]'}")
+    print(f"   No Side Effects: {'[PASS]' if test2_result else '[FAIL]'}")
+    print(f"   --check Entry Point: {'[PASS]' if test3_result else '[FAIL]'}")
+
+    if test1_result and test2_result and test3_result:
+        print("\n[SUCCESS] All tests passed! Startup stays within budget.")
+        sys.exit(0)
+    else:
+        print("\n[WARNING] Some tests failed. Please check the errors above.")
+        sys.exit(1)